@@ -0,0 +1,420 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import update
+from dotenv import load_dotenv
+
+from . import models, rollups
+from .database import SessionLocal
+
+load_dotenv()
+
+# async : réponse immédiate, les événements restent en mémoire jusqu'au prochain lot
+# group : la requête attend le commit groupé qui contient son événement
+# log   : l'événement est écrit dans answer_events avant de répondre, appliqué plus tard par lot
+DURABILITY_MODES = ("async", "group", "log")
+
+SESSION_WINDOW = timedelta(hours=1)
+
+# Un état utilisateur en cache sans réponse en attente est évincé après cette inactivité
+STATE_IDLE_SECONDS = 600
+
+RETRY_BASE_SECONDS = 0.05
+RETRY_MAX_SECONDS = 2.0
+
+
+def advance_streak(target, when):
+    """Met à jour current_streak / longest_streak / last_study_date pour une réponse à `when`"""
+    today = when.date()
+    if target.last_study_date:
+        last_date = target.last_study_date.date()
+        if last_date == today:
+            pass
+        elif last_date == today - timedelta(days=1):
+            target.current_streak += 1
+        else:
+            target.current_streak = 1
+    else:
+        target.current_streak = 1
+
+    target.longest_streak = max(target.longest_streak or 0, target.current_streak)
+    target.last_study_date = when
+
+
+class AnswerLog:
+    """
+    Tampon write-behind des réponses : calcule le résultat en mémoire
+    et applique points, séries et sessions par lots dans une seule transaction
+    """
+
+    def __init__(self, avatar_fn, durability=None, flush_ms=None, flush_batch=None, commit_timeout=None,
+                 max_retries=None):
+        self.avatar_fn = avatar_fn
+        self.durability = durability or os.getenv("ANSWER_DURABILITY", "group")
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"ANSWER_DURABILITY invalide: {self.durability}")
+        self.flush_interval = (flush_ms if flush_ms is not None
+                               else int(os.getenv("ANSWER_FLUSH_MS", "5"))) / 1000.0
+        self.flush_batch = flush_batch or int(os.getenv("ANSWER_FLUSH_BATCH", "100"))
+        self.commit_timeout = commit_timeout or float(os.getenv("ANSWER_COMMIT_TIMEOUT", "5"))
+        self.max_retries = max_retries or int(os.getenv("ANSWER_MAX_RETRIES", "5"))
+
+        self._buffer = []
+        self._users = {}
+        # Incrémenté à chaque éviction : un état chargé avant une éviction peut être périmé
+        self._evictions = 0
+        self._last_sweep = time.monotonic()
+        self._retry_at = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._worker = None
+        self._stats = {"events": 0, "flushes": 0, "failed_flushes": 0, "replayed": 0,
+                       "quarantined": 0, "lost": 0, "commit_timeouts": 0}
+
+    # === CYCLE DE VIE ===
+    def start(self):
+        try:
+            self.replay()
+        except Exception as e:
+            # Un événement impossible à appliquer ne doit pas empêcher le démarrage ; il reste dans le journal
+            print(f"❌ Rejeu du journal des réponses impossible: {e}")
+        self._worker = threading.Thread(target=self._run, name="answer-log", daemon=True)
+        self._worker.start()
+        print(f"📝 Journal des réponses: mode {self.durability}, "
+              f"lot toutes les {self.flush_interval*1000:.0f}ms ou {self.flush_batch} réponses")
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._worker:
+            self._worker.join(timeout=self.commit_timeout)
+        while self.flush():
+            pass
+        with self._cond:
+            if self._buffer:
+                print(f"⚠️ Arrêt avec {len(self._buffer)} réponses non commitées")
+
+    def replay(self):
+        """Applique les événements écrits dans answer_events mais jamais appliqués (crash)"""
+        db = SessionLocal()
+        try:
+            pending = db.query(models.AnswerEvent)\
+                .filter(models.AnswerEvent.applied == False)\
+                .order_by(models.AnswerEvent.id)\
+                .all()
+            if not pending:
+                return 0
+            self._apply(db, pending)
+            for event in pending:
+                event.applied = True
+            db.commit()
+            self._stats["replayed"] += len(pending)
+            print(f"♻️ {len(pending)} réponses rejouées depuis le journal")
+            return len(pending)
+        finally:
+            db.close()
+
+    # === ENREGISTREMENT ===
+    def record(self, db, user_id, topic, difficulty, is_correct, points):
+        """
+        Enregistre une réponse et retourne l'état de l'utilisateur après celle-ci,
+        ou None si l'utilisateur n'existe pas.
+        `committed` indique si la réponse est déjà durable au moment de répondre.
+        """
+        state = self._pin_state(db, user_id)
+        if state is None:
+            return None
+
+        now = datetime.utcnow()
+        event = SimpleNamespace(
+            id=None,
+            user_id=user_id,
+            topic=topic,
+            difficulty=difficulty,
+            is_correct=is_correct,
+            points=points,
+            created_at=now
+        )
+
+        if self.durability == "log":
+            try:
+                row = models.AnswerEvent(applied=False, **vars(event))
+                db.add(row)
+                db.commit()
+                event.id = row.id
+            except Exception:
+                with self._cond:
+                    state.pending -= 1
+                raise
+
+        # `state` est épinglé (pending > 0) : il ne peut pas être évincé entre les deux sections
+        with self._cond:
+            state.total_points += points
+            state.total_questions += 1
+            state.total_correct += 1 if is_correct else 0
+            advance_streak(state, now)
+            state.avatar = self.avatar_fn(state.total_correct / state.total_questions * 100)
+            result = {
+                "total_points": state.total_points,
+                "current_streak": state.current_streak,
+                "avatar": state.avatar,
+                "committed": self.durability == "log"
+            }
+
+            waiter = SimpleNamespace(done=threading.Event(), committed=False) \
+                if self.durability == "group" else None
+            self._buffer.append(SimpleNamespace(event=event, state=state, waiter=waiter, attempts=0))
+            self._stats["events"] += 1
+            if len(self._buffer) >= self.flush_batch:
+                self._cond.notify()
+
+        if waiter:
+            if not waiter.done.wait(self.commit_timeout):
+                with self._cond:
+                    self._stats["commit_timeouts"] += 1
+                print(f"⚠️ Commit groupé non confirmé après {self.commit_timeout}s")
+            result["committed"] = waiter.committed
+
+        return result
+
+    def _pin_state(self, db, user_id):
+        """
+        Retourne l'état en cache de l'utilisateur (chargé si absent) avec pending incrémenté,
+        ou None si l'utilisateur n'existe pas
+        """
+        loaded, generation = None, None
+        while True:
+            with self._cond:
+                state = self._users.get(user_id)
+                if state is None and loaded is not None and generation == self._evictions:
+                    state = self._users[user_id] = loaded
+                if state is not None:
+                    state.pending += 1
+                    state.last_used = time.monotonic()
+                    return state
+                generation = self._evictions
+            # Lecture en base hors verrou ; rechargée si une éviction a eu lieu entre-temps
+            loaded = self._load_state(db, user_id)
+            if loaded is None:
+                return None
+
+    def _load_state(self, db, user_id):
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if not user:
+            return None
+        total_questions, total_correct, _ = rollups.user_totals(db, user_id)
+        return SimpleNamespace(
+            total_points=user.total_points or 0,
+            current_streak=user.current_streak or 0,
+            longest_streak=user.longest_streak or 0,
+            last_study_date=user.last_study_date,
+            avatar=user.avatar,
+            total_questions=total_questions,
+            total_correct=total_correct,
+            pending=0,
+            last_used=time.monotonic()
+        )
+
+    def add_points(self, user_id, points):
+        """À appeler quand une autre route crédite des points (ex: bonus) déjà commités en base"""
+        with self._cond:
+            state = self._users.get(user_id)
+            if state is not None:
+                state.total_points += points
+            else:
+                # Un état en cours de chargement a pu lire la base avant le bonus : il sera rechargé
+                self._evictions += 1
+
+    def _evict(self, user_id, state):
+        """Retire `state` du cache s'il y est toujours (sous verrou)"""
+        if self._users.get(user_id) is state:
+            del self._users[user_id]
+            self._evictions += 1
+
+    def _sweep_idle(self, now):
+        """Évince les états sans réponse en attente et inutilisés depuis STATE_IDLE_SECONDS (sous verrou)"""
+        if now - self._last_sweep < STATE_IDLE_SECONDS:
+            return
+        self._last_sweep = now
+        for user_id, state in list(self._users.items()):
+            if state.pending == 0 and now - state.last_used > STATE_IDLE_SECONDS:
+                self._evict(user_id, state)
+
+    # === COMMIT GROUPÉ ===
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buffer) < self.flush_batch:
+                    self._cond.wait(self.flush_interval)
+                # Attente exponentielle après un commit groupé en échec
+                while not self._stopping and time.monotonic() < self._retry_at:
+                    self._cond.wait(self._retry_at - time.monotonic())
+                if self._stopping:
+                    return
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch = self._buffer[:self.flush_batch]
+                del self._buffer[:self.flush_batch]
+            if not batch:
+                return 0
+
+            events = [entry.event for entry in batch]
+            db = SessionLocal()
+            try:
+                if self.durability == "log":
+                    # Déjà dans le journal : on recharge les lignes pour les marquer appliquées
+                    ids = [event.id for event in events]
+                    events = db.query(models.AnswerEvent)\
+                        .filter(models.AnswerEvent.id.in_(ids))\
+                        .filter(models.AnswerEvent.applied == False)\
+                        .order_by(models.AnswerEvent.id)\
+                        .all()
+                else:
+                    db.add_all([models.AnswerEvent(applied=True, **vars(event)) for event in events])
+                self._apply(db, events)
+                if self.durability == "log":
+                    for event in events:
+                        event.applied = True
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                self._on_failure(batch, e)
+                return 0
+            finally:
+                db.close()
+
+            with self._cond:
+                self._stats["flushes"] += 1
+                self._retry_at = 0
+                for entry in batch:
+                    entry.state.pending -= 1
+                    if entry.waiter:
+                        entry.waiter.committed = True
+                        entry.waiter.done.set()
+                self._sweep_idle(time.monotonic())
+            return len(batch)
+
+    def _on_failure(self, batch, error):
+        with self._cond:
+            self._stats["failed_flushes"] += 1
+            attempts = max(entry.attempts for entry in batch) + 1
+            for entry in batch:
+                entry.attempts = attempts
+
+            if attempts < self.max_retries:
+                print(f"❌ Erreur commit groupé ({len(batch)} réponses, essai {attempts}/{self.max_retries}): {error}")
+                # Les événements repartent en tête du tampon après un délai croissant
+                self._buffer[:0] = batch
+                self._retry_at = time.monotonic() + min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                return
+
+            # Lot abandonné pour ne pas bloquer les réponses suivantes
+            self._stats["quarantined"] += len(batch)
+            self._retry_at = 0
+            for entry in batch:
+                entry.state.pending -= 1
+                # Le cache a compté ces réponses : on le recharge depuis la base
+                self._evict(entry.event.user_id, entry.state)
+                if entry.waiter:
+                    entry.waiter.done.set()
+
+        if self.durability != "log":
+            self._persist_unapplied(batch)
+        print(f"🚫 {len(batch)} réponses mises en quarantaine, rejouées au prochain démarrage: {error}")
+
+    def _persist_unapplied(self, batch):
+        """
+        Écrit les événements d'un lot abandonné dans answer_events (applied=False)
+        pour que replay() les applique au prochain démarrage
+        """
+        db = SessionLocal()
+        try:
+            db.add_all([models.AnswerEvent(applied=False, **vars(entry.event)) for entry in batch])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            with self._cond:
+                self._stats["lost"] += len(batch)
+            print(f"❌ {len(batch)} réponses perdues, écriture dans le journal impossible: {e}")
+        finally:
+            db.close()
+
+    def _apply(self, db, events):
+        """Applique une liste ordonnée d'événements : points, séries, sessions et avatar"""
+        by_user = {}
+        for event in events:
+            by_user.setdefault(event.user_id, []).append(event)
+
+        users = db.query(models.User)\
+            .filter(models.User.id.in_(list(by_user)))\
+            .all()
+        users = {u.id: u for u in users}
+
+        for user_id, user_events in by_user.items():
+            user = users.get(user_id)
+            if not user:
+                continue
+
+            # Incrément atomique : les autres routes (bonus) peuvent aussi modifier total_points
+            db.execute(
+                update(models.User)
+                .where(models.User.id == user_id)
+                .values(total_points=models.User.total_points + sum(e.points for e in user_events))
+            )
+            for event in user_events:
+                advance_streak(user, event.created_at)
+
+            self._apply_sessions(db, user_id, user_events)
+
+            db.flush()
+            total_questions, total_correct, _ = rollups.user_totals(db, user_id)
+            if total_questions > 0:
+                user.avatar = self.avatar_fn(total_correct / total_questions * 100)
+
+    def _apply_sessions(self, db, user_id, user_events):
+        by_topic = {}
+        for event in user_events:
+            by_topic.setdefault(event.topic, []).append(event)
+
+        for topic, topic_events in by_topic.items():
+            session = db.query(models.StudySession)\
+                .filter(models.StudySession.user_id == user_id)\
+                .filter(models.StudySession.topic == topic)\
+                .order_by(models.StudySession.created_at.desc())\
+                .first()
+
+            for event in topic_events:
+                if session and event.created_at - session.created_at < SESSION_WINDOW:
+                    session.questions_answered += 1
+                    if event.is_correct:
+                        session.correct_answers += 1
+                    session.points_earned += event.points
+                else:
+                    session = models.StudySession(
+                        user_id=user_id,
+                        topic=topic,
+                        questions_answered=1,
+                        correct_answers=1 if event.is_correct else 0,
+                        points_earned=event.points,
+                        difficulty=event.difficulty,
+                        created_at=event.created_at
+                    )
+                    db.add(session)
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s["buffered"] = len(self._buffer)
+            s["cached_users"] = len(self._users)
+        s["durability"] = self.durability
+        s["flush_ms"] = int(self.flush_interval * 1000)
+        s["flush_batch"] = self.flush_batch
+        s["max_retries"] = self.max_retries
+        return s
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import os
@@ -6,9 +6,12 @@ from dotenv import load_dotenv
 import json
 import re
 
-from . import models, database
+from . import models, database, rollups
 from .database import engine, get_db
 from .ollama_client import OllamaClient
+from .scheduler import GenerationScheduler
+from .answer_log import AnswerLog
+from .prefetch import QuizPrefetcher
 
 load_dotenv()
 
@@ -29,6 +32,9 @@ app.add_middleware(
 # Initialize Ollama client
 ollama = OllamaClient(model="llama3.2:3b")
 
+# Regroupe les générations concurrentes (fenêtre, taille de lot et parallélisme via .env)
+scheduler = GenerationScheduler(ollama)
+
 # Test Ollama connection at startup
 @app.on_event("startup")
 async def startup_event():
@@ -41,10 +47,22 @@ async def startup_event():
     else:
         print("⚠️ ATTENTION: Ollama n'est pas démarré!")
         print("💡 Démarrez-le avec: ollama serve")
+    
+    # Compacter les anciennes sessions en agrégats journaliers (au démarrage puis périodiquement)
+    rollups.start_compaction(database.SessionLocal)
+    
+    # Rejouer les réponses non appliquées puis démarrer le commit groupé
+    answer_log.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    answer_log.stop()
 
 # Pydantic models
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+
+# Nombre de questions demandé par le frontend, utilisé aussi pour le prefetch
+DEFAULT_NUM_QUESTIONS = 5
 
 class UserCreate(BaseModel):
     username: str
@@ -53,7 +71,8 @@ class UserCreate(BaseModel):
 class QuestionRequest(BaseModel):
     topic: str
     difficulty: str
-    num_questions: int = 5
+    num_questions: int = DEFAULT_NUM_QUESTIONS
+    user_id: int = None
 
 class AnswerSubmit(BaseModel):
     user_id: int
@@ -90,6 +109,8 @@ def calculate_avatar(accuracy):
     else:
         return "🎓"  # Diplôme - Nouveau
 
+# Tampon write-behind des réponses (mode de durabilité et taille des lots via .env)
+answer_log = AnswerLog(avatar_fn=calculate_avatar)
 
 
 # === USER ROUTES ===
@@ -108,18 +129,14 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
-@app.post("/api/generate-questions/")
-def generate_questions(request: QuestionRequest):
+def build_questions(topic, difficulty, num_questions, cancel_event=None, promote_event=None):
     """
-    🤖 Génère des questions ENTIÈREMENT avec l'IA locale (Ollama)
+    Génère et valide les questions avec Ollama
+    Utilisé par la route et par le prefetch en arrière-plan (cancel_event : génération
+    spéculative, basse priorité et abandonnée si l'événement est levé avant l'envoi ;
+    promote_event : un utilisateur attend ce quiz, il repasse en priorité normale)
     """
     
-    if not ollama.is_alive():
-        raise HTTPException(
-            status_code=503, 
-            detail="Ollama n'est pas disponible. Démarrez-le avec: ollama serve"
-        )
-    
     difficulty_instructions = {
         "easy": "Questions SIMPLES pour débutants. Vocabulaire facile.",
         "medium": "Questions INTERMÉDIAIRES. Mélange théorie et pratique.",
@@ -135,10 +152,10 @@ RÈGLES ABSOLUES:
 - Pas de markdown, pas d'explications
 - Format JSON strict"""
     
-    user_prompt = f"""Génère {request.num_questions} questions sur: {request.topic}
+    user_prompt = f"""Génère {num_questions} questions sur: {topic}
 
-Difficulté: {request.difficulty}
-{difficulty_instructions[request.difficulty]}
+Difficulté: {difficulty}
+{difficulty_instructions[difficulty]}
 
 FORMAT JSON (copie exactement ce format):
 [
@@ -157,16 +174,19 @@ IMPORTANT:
 - Texte simple et direct
 - N'utilise PAS de backslash ou guillemets dans les textes
 
-Génère maintenant {request.num_questions} questions:"""
+Génère maintenant {num_questions} questions:"""
 
     try:
         print(f"\n{'='*60}")
-        print(f"🎯 Génération {request.num_questions} questions: {request.topic}")
-        print(f"📊 Difficulté: {request.difficulty}")
+        print(f"🎯 Génération {num_questions} questions: {topic}")
+        print(f"📊 Difficulté: {difficulty}")
         print(f"{'='*60}\n")
         
         # Génération avec température plus basse pour plus de stabilité
-        response = ollama.generate(user_prompt, system_prompt=system_prompt, temperature=0.5)
+        # Jamais empaqueté : plusieurs quiz JSON ne tiennent pas dans le contexte du modèle
+        response = scheduler.generate(user_prompt, system_prompt=system_prompt, temperature=0.5,
+                                      cancel_event=cancel_event, packable=False,
+                                      promote_event=promote_event)
         
         if not response:
             raise HTTPException(
@@ -264,7 +284,7 @@ Génère maintenant {request.num_questions} questions:"""
         print(f"\n🎉 {len(validated_questions)} questions validées!")
         print(f"{'='*60}\n")
         
-        return {"questions": validated_questions[:request.num_questions]}
+        return {"questions": validated_questions[:num_questions]}
         
     except HTTPException:
         raise
@@ -274,6 +294,29 @@ Génère maintenant {request.num_questions} questions:"""
             status_code=500,
             detail=f"Erreur: {str(e)}"
         )
+
+
+# Prépare le quiz suivant pendant que l'utilisateur lit son feedback
+prefetcher = QuizPrefetcher(build_questions)
+
+@app.post("/api/generate-questions/")
+def generate_questions(request: QuestionRequest):
+    """
+    🤖 Génère des questions ENTIÈREMENT avec l'IA locale (Ollama)
+    """
+    
+    # Quiz déjà préparé en arrière-plan après le dernier feedback ?
+    prefetched = prefetcher.claim(request.user_id, request.topic, request.difficulty, request.num_questions)
+    if prefetched:
+        return prefetched
+    
+    if not ollama.is_alive():
+        raise HTTPException(
+            status_code=503, 
+            detail="Ollama n'est pas disponible. Démarrez-le avec: ollama serve"
+        )
+    
+    return build_questions(request.topic, request.difficulty, request.num_questions)
         
         
 # === FEEDBACK POST-QUIZ 100% GÉNÉRÉ PAR IA ===
@@ -335,7 +378,7 @@ Ton feedback (3-4 phrases en français, sois empathique):"""
         print(f"📊 Performance: {accuracy:.1f}% | Aimé: {feedback.liked_quiz}")
         print(f"{'='*60}\n")
         
-        ai_feedback = ollama.generate(user_prompt, system_prompt=system_prompt, temperature=0.8)
+        ai_feedback = scheduler.generate(user_prompt, system_prompt=system_prompt, temperature=0.8)
         
         if not ai_feedback:
             ai_feedback = "Merci d'avoir participé ! Continue à t'entraîner, chaque quiz te fait progresser ! 💪"
@@ -360,8 +403,12 @@ Ton feedback (3-4 phrases en français, sois empathique):"""
                 bonus_reason = "Bonus pour ton effort malgré la difficulté! 🌟"
         
         if should_give_bonus:
-            user.total_points += bonus_points
+            # Incrément atomique : le journal des réponses écrit aussi total_points
+            db.query(models.User)\
+                .filter(models.User.id == user.id)\
+                .update({models.User.total_points: models.User.total_points + bonus_points})
             db.commit()
+            answer_log.add_points(user.id, bonus_points)
             print(f"🎁 {bonus_points} points bonus donnés!")
         
         # Suggestion de difficulté
@@ -371,6 +418,9 @@ Ton feedback (3-4 phrases en français, sois empathique):"""
         elif accuracy > 85 and feedback.difficulty != "hard":
             suggested_difficulty = "hard" if feedback.difficulty == "medium" else "medium"
         
+        # Lancer la génération du prochain quiz probable en arrière-plan
+        prefetcher.schedule(feedback.user_id, feedback.topic, suggested_difficulty, DEFAULT_NUM_QUESTIONS)
+        
         print(f"✅ Feedback généré avec succès!")
         print(f"{'='*60}\n")
         
@@ -397,11 +447,7 @@ Ton feedback (3-4 phrases en français, sois empathique):"""
 # === ADAPTIVE DIFFICULTY ===
 @app.get("/api/suggest-difficulty/{user_id}")
 def suggest_difficulty(user_id: int, db: Session = Depends(get_db)):
-    sessions = db.query(models.StudySession)\
-        .filter(models.StudySession.user_id == user_id)\
-        .order_by(models.StudySession.created_at.desc())\
-        .limit(5)\
-        .all()
+    sessions = rollups.recent_sessions(db, user_id, limit=5)
     
     if not sessions:
         return {
@@ -444,68 +490,18 @@ def evaluate_answer(answer: AnswerSubmit, db: Session = Depends(get_db)):
         points_map = {"easy": 10, "medium": 20, "hard": 30}
         points = points_map.get(answer.difficulty, 10)
     
-    user = db.query(models.User).filter(models.User.id == answer.user_id).first()
-    if user:
-        user.total_points += points
-        
-        today = datetime.utcnow().date()
-        if user.last_study_date:
-            last_date = user.last_study_date.date()
-            if last_date == today:
-                pass
-            elif last_date == today - timedelta(days=1):
-                user.current_streak += 1
-            else:
-                user.current_streak = 1
-        else:
-            user.current_streak = 1
-        
-        user.longest_streak = max(user.longest_streak, user.current_streak)
-        user.last_study_date = datetime.utcnow()
-        
-        session = db.query(models.StudySession)\
-            .filter(models.StudySession.user_id == answer.user_id)\
-            .filter(models.StudySession.topic == answer.topic)\
-            .order_by(models.StudySession.created_at.desc())\
-            .first()
-        
-        if session and (datetime.utcnow() - session.created_at).seconds < 3600:
-            session.questions_answered += 1
-            if is_correct:
-                session.correct_answers += 1
-            session.points_earned += points
-        else:
-            new_session = models.StudySession(
-                user_id=answer.user_id,
-                topic=answer.topic,
-                questions_answered=1,
-                correct_answers=1 if is_correct else 0,
-                points_earned=points,
-                difficulty=answer.difficulty
-            )
-            db.add(new_session)
-        
-        # ✨ NOUVEAU : Calculer et mettre à jour l'avatar
-        all_sessions = db.query(models.StudySession)\
-            .filter(models.StudySession.user_id == answer.user_id)\
-            .all()
-        
-        total_questions = sum(s.questions_answered for s in all_sessions)
-        total_correct = sum(s.correct_answers for s in all_sessions)
-        
-        if total_questions > 0:
-            global_accuracy = (total_correct / total_questions) * 100
-            user.avatar = calculate_avatar(global_accuracy)
-            print(f"🎭 Avatar mis à jour pour {user.username}: {user.avatar} (Précision: {global_accuracy:.1f}%)")
-        
-        db.commit()
+    # Résultat calculé en mémoire, écriture en base par lots (answer_log.py)
+    result = answer_log.record(db, answer.user_id, answer.topic, answer.difficulty, is_correct, points)
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
     
     return {
         "is_correct": is_correct,
         "points_earned": points,
-        "total_points": user.total_points,
-        "current_streak": user.current_streak,
-        "avatar": user.avatar  # ✨ Retourner l'avatar
+        "total_points": result["total_points"],
+        "current_streak": result["current_streak"],
+        "avatar": result["avatar"],  # ✨ Retourner l'avatar
+        "committed": result["committed"]
     }
 # === LEADERBOARD ===
 @app.get("/api/leaderboard/")
@@ -520,12 +516,7 @@ def get_user_stats(user_id: int, db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    sessions = db.query(models.StudySession)\
-        .filter(models.StudySession.user_id == user_id)\
-        .all()
-    
-    total_questions = sum(s.questions_answered for s in sessions)
-    total_correct = sum(s.correct_answers for s in sessions)
+    total_questions, total_correct, sessions_count = rollups.user_totals(db, user_id)
     accuracy = (total_correct / total_questions * 100) if total_questions > 0 else 0
     
     # ✨ Mettre à jour l'avatar basé sur l'accuracy actuelle
@@ -537,14 +528,34 @@ def get_user_stats(user_id: int, db: Session = Depends(get_db)):
         "total_questions": total_questions,
         "total_correct": total_correct,
         "accuracy": round(accuracy, 1),
-        "sessions_count": len(sessions),
+        "sessions_count": sessions_count,
         "avatar": user.avatar  # ✨ Inclure l'avatar
     }
+# === HISTORIQUE PAGINÉ ===
+@app.get("/api/users/{user_id}/history")
+def get_user_history(
+    user_id: int,
+    cursor: str = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    Historique des sessions par pages (pagination par clé via next_cursor)
+    Les sessions compactées apparaissent comme des agrégats journaliers
+    """
+    try:
+        return rollups.session_history(db, user_id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
 # === HEALTH CHECK ===
 @app.get("/api/health")
 def health_check():
     return {
         "status": "ok",
         "ollama_status": "online" if ollama.is_alive() else "offline",
-        "model": ollama.model
+        "model": ollama.model,
+        "scheduler": scheduler.stats(),
+        "answer_log": answer_log.stats(),
+        "prefetch": prefetcher.stats()
     }
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -35,6 +35,49 @@ class StudySession(Base):
     
     user = relationship("User", back_populates="study_sessions")
 
+# Agrégats journaliers des sessions compactées (voir rollups.py)
+class StudySessionRollup(Base):
+    __tablename__ = "study_session_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "day", "topic", "difficulty"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    day = Column(Date, index=True)
+    topic = Column(String)
+    difficulty = Column(String)
+    sessions_count = Column(Integer, default=0)
+    questions_answered = Column(Integer, default=0)
+    correct_answers = Column(Integer, default=0)
+    points_earned = Column(Integer, default=0)
+
+# Sessions brutes déplacées hors de study_sessions après la période de rétention
+class StudySessionArchive(Base):
+    __tablename__ = "study_sessions_archive"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer)
+    user_id = Column(Integer, index=True)
+    topic = Column(String)
+    questions_answered = Column(Integer, default=0)
+    correct_answers = Column(Integer, default=0)
+    points_earned = Column(Integer, default=0)
+    difficulty = Column(String)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# Journal append-only des réponses, appliqué par lots (voir answer_log.py)
+class AnswerEvent(Base):
+    __tablename__ = "answer_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    topic = Column(String)
+    difficulty = Column(String)
+    is_correct = Column(Boolean, default=False)
+    points = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    applied = Column(Boolean, default=False, index=True)
+
 class Achievement(Base):
     __tablename__ = "achievements"
     
@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from types import SimpleNamespace
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class QuizPrefetcher:
+    """
+    Génère en arrière-plan le quiz probable suivant d'un utilisateur
+    et le garde dans un slot à durée de vie courte jusqu'à ce qu'il soit réclamé
+    """
+
+    def __init__(self, build_fn, ttl_seconds=None, enabled=None, workers=None, claim_timeout=None):
+        self.build_fn = build_fn
+        self.ttl = ttl_seconds or int(os.getenv("PREFETCH_TTL_SECONDS", "300"))
+        # Attente maximale d'un prefetch en cours avant de générer le quiz normalement
+        self.claim_timeout = claim_timeout or float(os.getenv("PREFETCH_CLAIM_TIMEOUT", "120"))
+        if enabled is None:
+            enabled = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=workers or int(os.getenv("PREFETCH_WORKERS", "1")))
+
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "hits": 0, "misses": 0, "wasted": 0, "failed": 0,
+                       "not_started": 0, "claim_timeouts": 0}
+
+    @staticmethod
+    def _key(topic, difficulty, num_questions):
+        return (topic.strip().lower(), difficulty, num_questions)
+
+    def _discard(self, slot):
+        """Abandonne un quiz préparé qui ne sera jamais servi (appelé sous verrou)"""
+        slot.future.cancel()
+        slot.cancel_event.set()
+        self._stats["wasted"] += 1
+
+    def _sweep(self, now):
+        """Supprime les slots expirés jamais réclamés (appelé sous verrou)"""
+        expired = [user_id for user_id, slot in self._slots.items() if slot.expires_at <= now]
+        for user_id in expired:
+            self._discard(self._slots.pop(user_id))
+
+    def schedule(self, user_id, topic, difficulty, num_questions):
+        """Lance la génération du prochain quiz probable, retourne True si un prefetch a démarré"""
+        if not self.enabled:
+            return False
+
+        key = self._key(topic, difficulty, num_questions)
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            existing = self._slots.get(user_id)
+            if existing and existing.key == key:
+                return False
+            if existing:
+                # Un autre quiz était préparé : il ne sera jamais servi
+                self._discard(existing)
+
+            # Génération spéculative : basse priorité côté scheduler, annulable tant qu'elle n'est pas envoyée
+            cancel_event = threading.Event()
+            promote_event = threading.Event()
+            future = self._executor.submit(self.build_fn, topic, difficulty, num_questions,
+                                           cancel_event=cancel_event, promote_event=promote_event)
+            self._slots[user_id] = SimpleNamespace(key=key, future=future, cancel_event=cancel_event,
+                                                   promote_event=promote_event, expires_at=now + self.ttl)
+            self._stats["started"] += 1
+
+        print(f"🔮 Prefetch lancé pour l'utilisateur {user_id}: {topic} ({difficulty})")
+        return True
+
+    def claim(self, user_id, topic, difficulty, num_questions):
+        """
+        Retourne le quiz préparé s'il correspond à la demande, sinon None.
+        Une génération en cours repasse en priorité normale et est attendue au plus
+        `claim_timeout` secondes ; une génération pas encore lancée est abandonnée
+        (l'appelant génère alors le quiz lui-même)
+        """
+        if not self.enabled or user_id is None:
+            return None
+
+        key = self._key(topic, difficulty, num_questions)
+        now = time.monotonic()
+        with self._lock:
+            slot = self._slots.pop(user_id, None)
+            if slot is None:
+                # Aucun prefetch pour cet utilisateur (ex: premier quiz) : ni hit ni miss
+                return None
+            if slot.key != key or slot.expires_at <= now:
+                self._discard(slot)
+                self._stats["misses"] += 1
+                return None
+            if slot.future.cancel():
+                # Encore dans la file du prefetch (derrière ceux d'autres utilisateurs) : inutile d'attendre
+                self._stats["not_started"] += 1
+                self._stats["misses"] += 1
+                return None
+
+        # Un utilisateur attend ce quiz : il ne doit plus céder la place aux autres requêtes
+        slot.promote_event.set()
+        try:
+            result = slot.future.result(timeout=self.claim_timeout)
+        except FutureTimeout:
+            slot.cancel_event.set()
+            print(f"⏱️ Prefetch trop long pour l'utilisateur {user_id}, génération directe")
+            with self._lock:
+                self._stats["claim_timeouts"] += 1
+                self._stats["misses"] += 1
+            return None
+        except Exception as e:
+            print(f"⚠️ Prefetch échoué pour l'utilisateur {user_id}: {e}")
+            with self._lock:
+                self._stats["failed"] += 1
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._stats["hits"] += 1
+        print(f"⚡ Quiz préchargé servi à l'utilisateur {user_id}")
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            s = dict(self._stats)
+            s["slots"] = len(self._slots)
+        claims = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / claims, 3) if claims else 0
+        s["waste_rate"] = round(s["wasted"] / s["started"], 3) if s["started"] else 0
+        s["enabled"] = self.enabled
+        s["ttl_seconds"] = self.ttl
+        s["claim_timeout"] = self.claim_timeout
+        return s
@@ -0,0 +1,281 @@
+import os
+import time
+import threading
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, or_, and_, insert, select, literal
+from dotenv import load_dotenv
+
+from . import models
+
+load_dotenv()
+
+RETENTION_DAYS = int(os.getenv("SESSION_RETENTION_DAYS", "30"))
+ARCHIVE_SESSIONS = os.getenv("SESSION_ARCHIVE", "true").lower() in ("1", "true", "yes")
+COMPACT_CHUNK = int(os.getenv("SESSION_COMPACT_CHUNK", "1000"))
+COMPACT_INTERVAL_HOURS = float(os.getenv("SESSION_COMPACT_INTERVAL_HOURS", "24"))
+
+# Une session peut encore recevoir des réponses pendant 1h : ne jamais compacter la journée en cours ni la veille
+MIN_RETENTION_DAYS = 1
+
+
+def retention_cutoff(retention_days=None):
+    """Minuit UTC du premier jour encore conservé en sessions brutes"""
+    days = RETENTION_DAYS if retention_days is None else retention_days
+    days = max(days, MIN_RETENTION_DAYS)
+    today = datetime.utcnow().date()
+    return datetime.combine(today - timedelta(days=days), datetime.min.time())
+
+
+def _as_date(value):
+    # func.date() renvoie une chaîne 'YYYY-MM-DD' sous SQLite
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def compact_sessions(db, retention_days=None, archive=None, chunk_size=None):
+    """
+    Compacte les sessions plus anciennes que la période de rétention en agrégats
+    journaliers par (user, topic, difficulty), puis archive ou supprime les lignes brutes.
+    Travaille par tranches d'ids, une transaction par tranche.
+    """
+    archive = ARCHIVE_SESSIONS if archive is None else archive
+    chunk_size = chunk_size or COMPACT_CHUNK
+    cutoff = retention_cutoff(retention_days)
+    S = models.StudySession
+    R = models.StudySessionRollup
+
+    # Les réponses déjà appliquées ne servent plus au rejeu après la rétention
+    pruned_events = db.query(models.AnswerEvent)\
+        .filter(models.AnswerEvent.applied == True)\
+        .filter(models.AnswerEvent.created_at < cutoff)\
+        .delete(synchronize_session=False)
+    db.commit()
+
+    compacted = 0
+    rollups_touched = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.query(S.id)
+               .filter(S.created_at < cutoff)
+               .filter(S.id > last_id)
+               .order_by(S.id)
+               .limit(chunk_size)
+               .all()]
+        if not ids:
+            break
+        in_chunk = and_(S.id >= ids[0], S.id <= ids[-1], S.created_at < cutoff)
+        last_id = ids[-1]
+
+        day = func.date(S.created_at)
+        groups = db.query(
+            S.user_id, day, S.topic, S.difficulty,
+            func.count(S.id),
+            func.coalesce(func.sum(S.questions_answered), 0),
+            func.coalesce(func.sum(S.correct_answers), 0),
+            func.coalesce(func.sum(S.points_earned), 0)
+        ).filter(in_chunk)\
+            .group_by(S.user_id, day, S.topic, S.difficulty)\
+            .all()
+        groups = [(user_id, _as_date(d), topic, difficulty, totals)
+                  for user_id, d, topic, difficulty, *totals in groups]
+
+        # Upsert : une seule requête pour retrouver les agrégats existants de la tranche
+        existing = db.query(R)\
+            .filter(R.user_id.in_({g[0] for g in groups}))\
+            .filter(R.day.in_({g[1] for g in groups}))\
+            .all()
+        existing = {(r.user_id, r.day, r.topic, r.difficulty): r for r in existing}
+
+        for user_id, d, topic, difficulty, (count, questions, correct, points) in groups:
+            rollup = existing.get((user_id, d, topic, difficulty))
+            if rollup is None:
+                db.add(R(
+                    user_id=user_id,
+                    day=d,
+                    topic=topic,
+                    difficulty=difficulty,
+                    sessions_count=count,
+                    questions_answered=questions,
+                    correct_answers=correct,
+                    points_earned=points
+                ))
+            else:
+                rollup.sessions_count += count
+                rollup.questions_answered += questions
+                rollup.correct_answers += correct
+                rollup.points_earned += points
+
+        if archive:
+            A = models.StudySessionArchive
+            db.execute(insert(A).from_select(
+                ["session_id", "user_id", "topic", "questions_answered", "correct_answers",
+                 "points_earned", "difficulty", "created_at", "archived_at"],
+                select(S.id, S.user_id, S.topic, S.questions_answered, S.correct_answers,
+                       S.points_earned, S.difficulty, S.created_at, literal(datetime.utcnow()))
+                .where(in_chunk)
+            ))
+
+        compacted += db.query(S).filter(in_chunk).delete(synchronize_session=False)
+        rollups_touched += len(groups)
+        db.commit()
+
+    if compacted:
+        print(f"🗜️ {compacted} sessions compactées ({rollups_touched} agrégats mis à jour, "
+              f"{'archivées' if archive else 'supprimées'}, avant {cutoff.date()})")
+
+    return {
+        "compacted_sessions": compacted,
+        "pruned_events": pruned_events,
+        "rollups_touched": rollups_touched,
+        "archived": archive and compacted > 0,
+        "cutoff": cutoff.isoformat()
+    }
+
+
+def start_compaction(session_factory, interval_hours=None):
+    """Compacte au démarrage puis toutes les `interval_hours` heures dans un thread de fond"""
+    interval = (interval_hours or COMPACT_INTERVAL_HOURS) * 3600
+
+    def loop():
+        while True:
+            db = session_factory()
+            try:
+                compact_sessions(db)
+            except Exception as e:
+                db.rollback()
+                print(f"❌ Erreur compaction des sessions: {e}")
+            finally:
+                db.close()
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="session-compaction", daemon=True).start()
+
+
+def user_totals(db, user_id):
+    """
+    Totaux d'un utilisateur : agrégats compactés + sessions brutes récentes
+    Retourne (total_questions, total_correct, sessions_count)
+    """
+    raw = db.query(
+        func.coalesce(func.sum(models.StudySession.questions_answered), 0),
+        func.coalesce(func.sum(models.StudySession.correct_answers), 0),
+        func.count(models.StudySession.id)
+    ).filter(models.StudySession.user_id == user_id).one()
+
+    rolled = db.query(
+        func.coalesce(func.sum(models.StudySessionRollup.questions_answered), 0),
+        func.coalesce(func.sum(models.StudySessionRollup.correct_answers), 0),
+        func.coalesce(func.sum(models.StudySessionRollup.sessions_count), 0)
+    ).filter(models.StudySessionRollup.user_id == user_id).one()
+
+    return (
+        int(raw[0]) + int(rolled[0]),
+        int(raw[1]) + int(rolled[1]),
+        int(raw[2]) + int(rolled[2])
+    )
+
+
+def recent_sessions(db, user_id, limit=5):
+    """
+    Les `limit` dernières sessions, en complétant avec les agrégats journaliers
+    si les sessions brutes ne suffisent pas
+    """
+    sessions = db.query(models.StudySession)\
+        .filter(models.StudySession.user_id == user_id)\
+        .order_by(models.StudySession.created_at.desc())\
+        .limit(limit)\
+        .all()
+
+    if len(sessions) < limit:
+        sessions += db.query(models.StudySessionRollup)\
+            .filter(models.StudySessionRollup.user_id == user_id)\
+            .order_by(models.StudySessionRollup.day.desc(), models.StudySessionRollup.id.desc())\
+            .limit(limit - len(sessions))\
+            .all()
+
+    return sessions
+
+
+def encode_cursor(kind, key, row_id):
+    return f"{kind}:{key}:{row_id}"
+
+
+def decode_cursor(cursor):
+    kind, rest = cursor.split(":", 1)
+    key, row_id = rest.rsplit(":", 1)
+    if kind == "s":
+        return kind, datetime.fromisoformat(key), int(row_id)
+    if kind == "r":
+        return kind, date.fromisoformat(key), int(row_id)
+    raise ValueError(f"Curseur inconnu: {cursor}")
+
+
+def session_history(db, user_id, cursor=None, limit=20):
+    """
+    Historique paginé par clé (du plus récent au plus ancien) :
+    d'abord les sessions brutes, puis les agrégats journaliers déjà compactés
+    """
+    items = []
+    kind, key, row_id = decode_cursor(cursor) if cursor else ("s", None, None)
+
+    if kind == "s":
+        query = db.query(models.StudySession)\
+            .filter(models.StudySession.user_id == user_id)
+        if key is not None:
+            query = query.filter(or_(
+                models.StudySession.created_at < key,
+                and_(models.StudySession.created_at == key, models.StudySession.id < row_id)
+            ))
+        sessions = query\
+            .order_by(models.StudySession.created_at.desc(), models.StudySession.id.desc())\
+            .limit(limit + 1)\
+            .all()
+
+        for s in sessions[:limit]:
+            items.append({
+                "type": "session",
+                "id": s.id,
+                "topic": s.topic,
+                "difficulty": s.difficulty,
+                "questions_answered": s.questions_answered,
+                "correct_answers": s.correct_answers,
+                "points_earned": s.points_earned,
+                "created_at": s.created_at.isoformat(),
+                "cursor": encode_cursor("s", s.created_at.isoformat(), s.id)
+            })
+
+        if len(sessions) > limit:
+            return {"items": items, "next_cursor": items[-1]["cursor"]}
+
+        # Sessions brutes épuisées -> on enchaîne sur les agrégats
+        key, row_id = None, None
+
+    query = db.query(models.StudySessionRollup)\
+        .filter(models.StudySessionRollup.user_id == user_id)
+    if key is not None:
+        query = query.filter(or_(
+            models.StudySessionRollup.day < key,
+            and_(models.StudySessionRollup.day == key, models.StudySessionRollup.id < row_id)
+        ))
+    remaining = limit - len(items)
+    rollups = query\
+        .order_by(models.StudySessionRollup.day.desc(), models.StudySessionRollup.id.desc())\
+        .limit(remaining + 1)\
+        .all()
+
+    for r in rollups[:remaining]:
+        items.append({
+            "type": "daily_rollup",
+            "id": r.id,
+            "topic": r.topic,
+            "difficulty": r.difficulty,
+            "sessions_count": r.sessions_count,
+            "questions_answered": r.questions_answered,
+            "correct_answers": r.correct_answers,
+            "points_earned": r.points_earned,
+            "day": r.day.isoformat(),
+            "cursor": encode_cursor("r", r.day.isoformat(), r.id)
+        })
+
+    # Si la page est déjà pleine de sessions brutes, le curseur "s" mène aux agrégats suivants
+    next_cursor = items[-1]["cursor"] if len(rollups) > remaining else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,303 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SECTION_MARKER = "===SECTION {n}==="
+SECTION_PATTERN = re.compile(r"===\s*SECTION\s+(\d+)\s*===")
+
+# Intervalle de vérification de l'annulation / promotion d'un job spéculatif en attente
+CANCEL_POLL_SECONDS = 0.2
+
+# Poids du dernier appel dans la moyenne mobile de latence d'un appel seul
+BASELINE_ALPHA = 0.2
+
+
+class GenerationJob:
+    def __init__(self, prompt, system_prompt=None, temperature=0.7):
+        self.prompt = prompt
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.packable = True
+
+    def pack_key(self):
+        """Deux jobs sont compatibles s'ils partagent le même system prompt et la même température"""
+        return (self.system_prompt, self.temperature)
+
+    def size(self):
+        return len(self.prompt) + len(self.system_prompt or "")
+
+
+class GenerationScheduler:
+    """
+    Envoie les générations à Ollama en parallèle (au plus `parallelism` appels en cours),
+    et peut empaqueter les prompts courts compatibles dans un seul appel.
+    Les jobs spéculatifs (prefetch) ne partent que lorsque Ollama est inactif.
+    """
+
+    def __init__(self, client, window_ms=None, max_batch=None, parallelism=None, packing=None,
+                 pack_max_chars=None):
+        self.client = client
+        self.window = (window_ms if window_ms is not None
+                       else int(os.getenv("GENERATION_BATCH_WINDOW_MS", "20"))) / 1000.0
+        self.max_batch = max_batch or int(os.getenv("GENERATION_MAX_BATCH", "4"))
+        self.parallelism = parallelism or int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))
+        if packing is None:
+            packing = os.getenv("GENERATION_PACKING", "false").lower() in ("1", "true", "yes")
+        self.packing = packing
+        # num_ctx=2048 côté OllamaClient : prompt empaqueté + réponses doivent y tenir
+        self.pack_max_chars = pack_max_chars or int(os.getenv("GENERATION_PACK_MAX_CHARS", "2400"))
+
+        self._queue = []
+        self._background = []
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(self.parallelism)
+        self._executor = ThreadPoolExecutor(max_workers=self.parallelism)
+        self._in_flight = 0
+        self._busy_since = None
+        self._baseline = {}
+        self._stats = {
+            "jobs": 0,
+            "llm_calls": 0,
+            "single_calls": 0,
+            "packed_calls": 0,
+            "packed_jobs": 0,
+            "pack_fallbacks": 0,
+            "single_seconds": 0.0,
+            "packed_seconds": 0.0,
+            "serial_equivalent_seconds": 0.0,
+            "busy_seconds": 0.0,
+            "background_jobs": 0,
+            "background_cancelled": 0,
+            "background_promoted": 0,
+        }
+
+        self._worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._worker.start()
+        print(f"🧮 Scheduler de génération: fenêtre {self.window*1000:.0f}ms, "
+              f"lot max {self.max_batch}, parallélisme {self.parallelism}, packing {self.packing}")
+
+    def generate(self, prompt, system_prompt=None, temperature=0.7, cancel_event=None, packable=True,
+                 promote_event=None):
+        """
+        Même signature que OllamaClient.generate, mais passe par la file d'attente.
+        Avec `cancel_event`, le job est spéculatif : basse priorité, et abandonné
+        (retourne None) si l'événement est levé avant son envoi à Ollama.
+        Si `promote_event` est levé avant l'envoi (un utilisateur attend ce résultat),
+        le job spéculatif passe dans la file prioritaire.
+        `packable=False` pour les prompts dont la réponse est trop longue pour être empaquetée.
+        """
+        job = GenerationJob(prompt, system_prompt=system_prompt, temperature=temperature)
+        job.packable = packable
+        with self._cond:
+            if cancel_event is None:
+                self._queue.append(job)
+            else:
+                self._background.append(job)
+                self._stats["background_jobs"] += 1
+            self._cond.notify_all()
+
+        if cancel_event is None:
+            return job.future.result()
+
+        while True:
+            try:
+                return job.future.result(timeout=CANCEL_POLL_SECONDS)
+            except FutureTimeout:
+                pass
+            with self._cond:
+                if job not in self._background:
+                    # Déjà envoyé à Ollama ou promu : on attend simplement la réponse
+                    continue
+                if promote_event is not None and promote_event.is_set():
+                    self._background.remove(job)
+                    self._queue.append(job)
+                    self._stats["background_promoted"] += 1
+                    self._cond.notify_all()
+                elif cancel_event.is_set():
+                    self._background.remove(job)
+                    self._stats["background_cancelled"] += 1
+                    return None
+
+    # === DISTRIBUTION ===
+    def _run(self):
+        while True:
+            # Un appel ne part que si un slot Ollama est libre ; le dispatcher n'attend jamais la fin d'un appel
+            self._slots.acquire()
+            with self._cond:
+                # Priorité aux requêtes des utilisateurs ; un job spéculatif attend qu'Ollama soit inactif
+                while not self._queue and not (self._background and self._in_flight == 0):
+                    self._cond.wait()
+                if self._queue:
+                    if self.packing and self._queue[0].packable:
+                        # Laisser la fenêtre se remplir pour trouver des jobs à empaqueter
+                        deadline = self._queue[0].submitted_at + self.window
+                        while len(self._queue) < self.max_batch:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self._cond.wait(remaining)
+                    group = self._take_group()
+                else:
+                    group = [self._background.pop(0)]
+                self._begin_call()
+            self._executor.submit(self._run_group, group)
+
+    def _take_group(self):
+        """Retire de la file le prochain job et, si possible, des jobs compatibles à empaqueter (sous verrou)"""
+        head = self._queue.pop(0)
+        group = [head]
+        if not (self.packing and head.packable) or head.size() > self.pack_max_chars:
+            return group
+
+        size = head.size()
+        for job in list(self._queue):
+            if len(group) >= self.max_batch:
+                break
+            if not job.packable or job.pack_key() != head.pack_key():
+                continue
+            # Le system prompt n'est envoyé qu'une fois
+            if size + len(job.prompt) > self.pack_max_chars:
+                continue
+            size += len(job.prompt)
+            group.append(job)
+            self._queue.remove(job)
+        return group
+
+    def _begin_call(self):
+        """Appelé sous verrou au départ d'un appel"""
+        if self._in_flight == 0:
+            self._busy_since = time.monotonic()
+        self._in_flight += 1
+
+    def _end_call(self):
+        with self._cond:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._stats["busy_seconds"] += time.monotonic() - self._busy_since
+                self._busy_since = None
+            self._cond.notify_all()
+        self._slots.release()
+
+    def _run_group(self, group):
+        try:
+            if len(group) == 1:
+                self._run_single(group[0])
+            else:
+                self._run_packed(group)
+        except Exception as e:
+            print(f"❌ Erreur scheduler: {e}")
+            for job in group:
+                if not job.future.done():
+                    job.future.set_result(None)
+        finally:
+            self._end_call()
+
+    def _run_single(self, job):
+        started = time.monotonic()
+        response = self.client.generate(job.prompt, system_prompt=job.system_prompt,
+                                        temperature=job.temperature)
+        elapsed = time.monotonic() - started
+        job.future.set_result(response)
+
+        with self._cond:
+            key = job.pack_key()
+            previous = self._baseline.get(key)
+            self._baseline[key] = elapsed if previous is None else \
+                (1 - BASELINE_ALPHA) * previous + BASELINE_ALPHA * elapsed
+            self._stats["jobs"] += 1
+            self._stats["llm_calls"] += 1
+            self._stats["single_calls"] += 1
+            self._stats["single_seconds"] += elapsed
+            self._stats["serial_equivalent_seconds"] += elapsed
+
+    def _run_packed(self, group):
+        started = time.monotonic()
+        responses = self._generate_packed(group)
+        elapsed = time.monotonic() - started
+
+        with self._cond:
+            self._stats["llm_calls"] += 1
+            self._stats["packed_calls"] += 1
+            self._stats["packed_seconds"] += elapsed
+
+            if responses is None:
+                # Découpage impossible -> chaque job repart seul, en tête de file, par le chemin parallèle
+                self._stats["pack_fallbacks"] += 1
+                for job in group:
+                    job.packable = False
+                self._queue[:0] = group
+                self._cond.notify_all()
+                return
+
+            self._stats["jobs"] += len(group)
+            self._stats["packed_jobs"] += len(group)
+            # Coût estimé des mêmes jobs envoyés seuls : latence mesurée des appels seuls.
+            # Sans mesure disponible, on ne revendique aucun gain pour cet appel.
+            baseline = self._baseline.get(group[0].pack_key())
+            self._stats["serial_equivalent_seconds"] += baseline * len(group) if baseline else elapsed
+
+        for job, response in zip(group, responses):
+            job.future.set_result(response)
+
+    def _generate_packed(self, group):
+        """
+        Envoie plusieurs prompts compatibles en un seul appel multi-sections
+        Retourne la liste des réponses, ou None si le découpage échoue
+        """
+        sections = []
+        for n, job in enumerate(group, start=1):
+            sections.append(f"{SECTION_MARKER.format(n=n)}\n{job.prompt}")
+
+        packed_system = group[0].system_prompt or ""
+        packed_system += f"""
+
+Tu vas recevoir {len(group)} demandes indépendantes.
+Réponds à chacune séparément, dans l'ordre.
+Commence chaque réponse par sa ligne de section exacte (par exemple {SECTION_MARKER.format(n=1)}).
+N'écris rien d'autre entre les sections."""
+
+        response = self.client.generate("\n\n".join(sections), system_prompt=packed_system.strip(),
+                                        temperature=group[0].temperature)
+        if not response:
+            return None
+
+        parts = SECTION_PATTERN.split(response)
+        # parts = [préambule, "1", texte1, "2", texte2, ...]
+        answers = {}
+        for i in range(1, len(parts) - 1, 2):
+            answers[int(parts[i])] = parts[i + 1].strip()
+
+        if sorted(answers) != list(range(1, len(group) + 1)) or not all(answers.values()):
+            print(f"⚠️ Réponse empaquetée non découpable ({len(answers)}/{len(group)} sections)")
+            return None
+        return [answers[n] for n in range(1, len(group) + 1)]
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            if self._busy_since is not None:
+                s["busy_seconds"] += time.monotonic() - self._busy_since
+            s["queued"] = len(self._queue)
+            s["queued_background"] = len(self._background)
+            s["in_flight"] = self._in_flight
+
+        s["jobs_per_llm_call"] = round(s["jobs"] / s["llm_calls"], 2) if s["llm_calls"] else 0
+        s["avg_single_latency"] = round(s["single_seconds"] / s["single_calls"], 2) if s["single_calls"] else 0
+        s["avg_packed_latency"] = round(s["packed_seconds"] / s["packed_calls"], 2) if s["packed_calls"] else 0
+        # Temps qu'auraient pris les mêmes jobs servis un par un / temps réel où Ollama était occupé
+        s["throughput_gain"] = round(s["serial_equivalent_seconds"] / s["busy_seconds"], 2) if s["busy_seconds"] else 0
+        for key in ("single_seconds", "packed_seconds", "serial_equivalent_seconds", "busy_seconds"):
+            s[key] = round(s[key], 2)
+        s["window_ms"] = int(self.window * 1000)
+        s["max_batch"] = self.max_batch
+        s["parallelism"] = self.parallelism
+        s["packing"] = self.packing
+        s["pack_max_chars"] = self.pack_max_chars
+        return s
@@ -56,7 +56,8 @@ function App() {
       const response = await axios.post(`${API_URL}/generate-questions/`, {
         topic,
         difficulty,
-        num_questions: 5
+        num_questions: 5,
+        user_id: user?.id
       });
       
       setQuizData({
@@ -111,6 +112,7 @@ function App() {
     user={user}
     quizData={quizData}
     onNavigate={navigateTo}
+    onStartQuiz={startQuiz}
     apiUrl={API_URL}  // ← Ajoutez cette ligne
   />
 )}
@@ -1,11 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 
-function Results({ user, quizData, onNavigate, apiUrl }) {
+function Results({ user, quizData, onNavigate, onStartQuiz, apiUrl }) {
   const [feedback, setFeedback] = useState(null);
   const [loading, setLoading] = useState(true);
   const [likedQuiz, setLikedQuiz] = useState(null);
   const [showFeedbackQuestion, setShowFeedbackQuestion] = useState(true);
+  const [starting, setStarting] = useState(false);
 
   const totalQuestions = quizData.questions.length;
   const pointsPerCorrect = quizData.difficulty === 'easy' ? 10 : quizData.difficulty === 'medium' ? 20 : 30;
@@ -40,6 +41,13 @@ function Results({ user, quizData, onNavigate, apiUrl }) {
     }
   };
 
+  // Même sujet au niveau suggéré : le backend a déjà préparé ce quiz en arrière-plan
+  const handlePlayAgain = async () => {
+    setStarting(true);
+    await onStartQuiz(quizData.topic, feedback.suggested_difficulty);
+    setStarting(false);
+  };
+
   return (
     <>
       <header className="header">
@@ -140,6 +148,11 @@ function Results({ user, quizData, onNavigate, apiUrl }) {
         )}
 
         <div className="results-actions">
+          {feedback && feedback.suggested_difficulty && (
+            <button onClick={handlePlayAgain} className="btn btn-primary" disabled={starting}>
+              {starting ? '⏳ Préparation...' : `▶️ Rejouer (${feedback.suggested_difficulty})`}
+            </button>
+          )}
           <button onClick={() => onNavigate('home')} className="btn btn-primary">
             🔄 Nouveau Quiz
           </button>